@@ -1,7 +1,13 @@
+import os
+from io import BytesIO
 import streamlit as st
 import pandas as pd
+import numpy as np
 import pydeck as pdk
-import matplotlib.pyplot as plt
+from kernels import top_n_by_code
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
 
 # --- Documentation String ---
 """
@@ -23,69 +29,181 @@ and fully interactive, making it perfect for students, analysts, or anyone curio
 """
 
 # --- Load Data ---
+DATA_COLS = ['Company', 'Continent', 'Sales ($billion)', 'Profits ($billion)', 'Assets ($billion)',
+             'Market Value ($billion)', 'Latitude_final', 'Longitude_final']
+
+CSV_PATH = "Top2000_Companies_Globally_Fixed.csv"
+PARQUET_PATH = "Top2000_Companies_Globally_Fixed.parquet"
+
 @st.cache_data
-def load_data():
-    df = pd.read_csv("Top2000_Companies_Globally_Fixed.csv")
+def load_data(csv_mtime):
+    # The parquet copy is only trusted while it is at least as new as the CSV
+    if os.path.exists(PARQUET_PATH) and os.path.getmtime(PARQUET_PATH) >= csv_mtime:
+        df = pd.read_parquet(PARQUET_PATH, engine='pyarrow', columns=DATA_COLS)
+    else:
+        df = pd.read_csv(CSV_PATH, engine='pyarrow', usecols=DATA_COLS,
+                         dtype={'Continent': 'category'}, dtype_backend='pyarrow')
+        try:
+            df.to_parquet(PARQUET_PATH, compression='zstd')
+        except OSError:
+            pass
     return df
 
-df = load_data()
+# Every cache derived from df takes DATA_VERSION as its first argument, so editing the CSV invalidates them all
+DATA_VERSION = os.path.getmtime(CSV_PATH)
+df = load_data(DATA_VERSION)
+
+NUMERIC_COLS = ['Sales ($billion)', 'Profits ($billion)', 'Assets ($billion)', 'Market Value ($billion)']
+
+@st.cache_data
+def continent_choices(data_version):
+    cats = df['Continent'].cat.categories.tolist()
+    code_of = {c: i for i, c in enumerate(cats)}
+    return cats, code_of
+
+@st.cache_resource(max_entries=1)
+def continent_codes(data_version):
+    codes = df['Continent'].cat.codes.to_numpy(dtype=np.int8)
+    codes.flags.writeable = False
+    return codes
+
+@st.cache_data
+def get_top(data_version, continent, metric, top_n):
+    vals = arrays(data_version)[metric]
+    target_code = continent_choices(data_version)[1][continent]
+    idx = top_n_by_code(continent_codes(data_version), vals, target_code, top_n)
+    idx = idx[np.lexsort((idx, -vals[idx]))]
+    return df.take(idx).reset_index(drop=True)
+
+@st.cache_data
+def valid_loc_idx(data_version):
+    return np.flatnonzero(df[['Latitude_final', 'Longitude_final']].notna().all(axis=1).to_numpy())
+
+@st.cache_data
+def get_map_df(data_version):
+    return df.iloc[valid_loc_idx(data_version)][['Company', 'Latitude_final', 'Longitude_final', 'Market Value ($billion)']]
+
+# float32 copies for the numeric kernels; the DataFrame itself stays float64 for display and the map JSON.
+# Read-only arrays live in cache_resource so every caller shares one buffer instead of an unpickled copy
+@st.cache_resource(max_entries=1)
+def arrays(data_version):
+    A = {c: df[c].to_numpy(dtype='float32', na_value=np.nan) for c in NUMERIC_COLS + ['Latitude_final', 'Longitude_final']}
+    for arr in A.values():
+        arr.flags.writeable = False
+    return A
+
+@st.cache_data
+def map_center(data_version):
+    A = arrays(data_version)
+    return float(np.nanmean(A['Latitude_final'])), float(np.nanmean(A['Longitude_final']))
+
+@st.cache_data
+def corr_np(data_version):
+    A = arrays(data_version)
+    M = np.vstack([A[c] for c in NUMERIC_COLS])  # [PY4]
+    M = M[:, np.isfinite(M).all(axis=0)]  # corrcoef has no NaN handling, so drop incomplete rows
+    return NUMERIC_COLS, np.corrcoef(M)
+
+def describe_relationship(x, y):
+    """[PY2] Returns a statement about correlation"""
+    cols, C = corr_np(DATA_VERSION)
+    return f"Correlation between {x} and {y}: {C[cols.index(x), cols.index(y)]:.2f}"
+
+@st.cache_data
+def column_means(data_version):
+    return df[NUMERIC_COLS].mean()
+
+# Charts are cached as rendered PNG bytes, so reruns skip savefig and no Figure is shared between sessions.
+# Figure() is used rather than plt.subplots() so pyplot never tracks them
+def fig_to_png(fig):
+    buf = BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight', dpi=200)  # same settings st.pyplot uses
+    return buf.getvalue()
+
+@st.cache_data(max_entries=64)
+def bar_png(data_version, continent, metric, top_n):
+    filtered_sorted = get_top(data_version, continent, metric, top_n)
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.barh(filtered_sorted['Company'], filtered_sorted[metric], color='skyblue')
+    ax.set_xlabel(metric)
+    ax.set_ylabel("Company")
+    ax.invert_yaxis()
+    return fig_to_png(fig)
+
+@st.cache_data(max_entries=16)
+def scatter_png(data_version, x_axis, y_axis):
+    A = arrays(data_version)
+    fig = Figure()
+    ax = fig.subplots()
+    hb = ax.hexbin(A[x_axis], A[y_axis], gridsize=40, bins='log', mincnt=1)
+    fig.colorbar(hb, ax=ax)
+    ax.set_xlabel(x_axis)
+    ax.set_ylabel(y_axis)
+    return fig_to_png(fig)
+
+@st.cache_data
+def map_payload(data_version):
+    lat, lon = map_center(data_version)
+    return {'data': get_map_df(data_version).to_dict('records'), 'lat': lat, 'lon': lon}
+
+@st.cache_resource(max_entries=1)
+def build_deck(data_version):
+    payload = map_payload(data_version)
+    return pdk.Deck(
+        map_style='mapbox://styles/mapbox/light-v9',
+        initial_view_state=pdk.ViewState(
+            latitude=payload['lat'],
+            longitude=payload['lon'],
+            zoom=1.5,
+            pitch=0,
+        ),
+        layers=[
+            pdk.Layer(
+                'ScatterplotLayer',
+                data=payload['data'],
+                get_position='[Longitude_final, Latitude_final]',
+                get_radius=10000,
+                get_fill_color='[180, 0, 200, 140]',
+                pickable=True
+            )
+        ],
+        tooltip={"text": "{Company}\nMarket Value: ${Market Value ($billion)}B"}
+    )
 
 # --- Sidebar Widgets ---
 st.sidebar.title("Filters")
-continent = st.sidebar.selectbox("Select Continent", df['Continent'].unique())
-metric = st.sidebar.selectbox("Select Metric", ['Sales ($billion)', 'Profits ($billion)', 'Assets ($billion)', 'Market Value ($billion)'])
+continents, code_of = continent_choices(DATA_VERSION)
+# Categories are alphabetical; default to the first company's continent (Asia) as the unsorted list did
+continent = st.sidebar.selectbox("Select Continent", continents, index=code_of[df['Continent'].iloc[0]])
+metric = st.sidebar.selectbox("Select Metric", NUMERIC_COLS)
 top_n = st.sidebar.slider("Top N Companies", 5, 50, 10)
 
 # --- Filter Data ---
-filtered_df = df[df['Continent'] == continent]
-filtered_sorted = filtered_df.sort_values(by=metric, ascending=False).head(top_n)
+filtered_sorted = get_top(DATA_VERSION, continent, metric, top_n)
 
 # --- Bar Chart ---
 st.header(f"Top {top_n} Companies in {continent} by {metric}")
-fig, ax = plt.subplots(figsize=(10, 6))
-ax.barh(filtered_sorted['Company'], filtered_sorted[metric], color='skyblue')
-ax.set_xlabel(metric)
-ax.set_ylabel("Company")
-ax.invert_yaxis()
-st.pyplot(fig)
+st.image(bar_png(DATA_VERSION, continent, metric, top_n))
 
 # --- Scatter Plot ---
-x_axis = st.selectbox("X-axis", ['Sales ($billion)', 'Assets ($billion)', 'Profits ($billion)'])
-y_axis = st.selectbox("Y-axis", ['Profits ($billion)', 'Market Value ($billion)', 'Sales ($billion)'])
-st.subheader(f"Scatter Plot: {x_axis} vs {y_axis}")
-fig2, ax2 = plt.subplots()
-ax2.scatter(df[x_axis], df[y_axis], alpha=0.5)
-ax2.set_xlabel(x_axis)
-ax2.set_ylabel(y_axis)
-st.pyplot(fig2)
+with st.expander("Scatter Plot", expanded=False):
+    x_axis = st.selectbox("X-axis", ['Sales ($billion)', 'Assets ($billion)', 'Profits ($billion)'])
+    y_axis = st.selectbox("Y-axis", ['Profits ($billion)', 'Market Value ($billion)', 'Sales ($billion)'])
+    st.markdown(f"**{describe_relationship(x_axis, y_axis)}**")
+    # Expander bodies still run on every rerun, so the checkbox is what actually skips the chart
+    if st.checkbox("Render scatter plot", key='render_scatter'):
+        st.subheader(f"Scatter Plot: {x_axis} vs {y_axis}")
+        st.image(scatter_png(DATA_VERSION, x_axis, y_axis))
 
 # --- PyDeck Map ---
-st.subheader("Map of Top Companies by Location")
-map_df = df[['Company', 'Latitude_final', 'Longitude_final', 'Market Value ($billion)']].dropna()
-st.pydeck_chart(pdk.Deck(
-    map_style='mapbox://styles/mapbox/light-v9',
-    initial_view_state=pdk.ViewState(
-        latitude=map_df['Latitude_final'].mean(),
-        longitude=map_df['Longitude_final'].mean(),
-        zoom=1.5,
-        pitch=0,
-    ),
-    layers=[
-        pdk.Layer(
-            'ScatterplotLayer',
-            data=map_df,
-            get_position='[Longitude_final, Latitude_final]',
-            get_radius=10000,
-            get_fill_color='[180, 0, 200, 140]',
-            pickable=True
-        )
-    ],
-    tooltip={"text": "{Company}\nMarket Value: ${Market Value ($billion)}B"}
-))
+with st.expander("Map of Top Companies by Location", expanded=False):
+    if st.checkbox("Render map", key='render_map'):  # same lazy gate as the scatter plot
+        st.pydeck_chart(build_deck(DATA_VERSION))
 
 # --- Summary Table ---
-st.subheader("Filtered Company Data")
-st.dataframe(filtered_sorted)
+with st.expander("Filtered Company Data", expanded=False):
+    st.dataframe(filtered_sorted)
 
 # --- Data Analytics Tags ---
 # [DA1] Clean the data (loaded as-is, assumed clean)
@@ -96,13 +214,7 @@ st.dataframe(filtered_sorted)
 # [DA9] Perform calculations or view data
 
 # --- Python Feature Tags ---
-def describe_relationship(x, y):
-    """[PY2] Returns a statement about correlation"""
-    corr = df[x].corr(df[y])
-    return f"Correlation between {x} and {y}: {corr:.2f}"
-
-st.markdown(f"**{describe_relationship(x_axis, y_axis)}**")
-
+# [PY2] describe_relationship (defined above the scatter plot)
 # [PY1] Function with default
 # [PY3] Error handling
 # [PY4] List comprehension
@@ -110,9 +222,9 @@ st.markdown(f"**{describe_relationship(x_axis, y_axis)}**")
 
 def safe_get_columns(cols):
     try:
-        return [df[col].mean() for col in cols]  # [PY4]
-    except KeyError as e:
-        return [0 for _ in cols]  # [PY3]
+        return column_means(DATA_VERSION).loc[cols].to_numpy(dtype='float64')
+    except KeyError:
+        return np.zeros(len(cols))  # [PY3]
 
 col_stats = dict(zip(['Sales', 'Profit'], safe_get_columns(['Sales ($billion)', 'Profits ($billion)'])))  # [PY5]
 st.markdown(f"**Average Sales:** {col_stats['Sales']:.2f}B | **Average Profit:** {col_stats['Profit']:.2f}B")
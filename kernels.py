@@ -0,0 +1,36 @@
+"""Numba kernels used by app.py"""
+import numpy as np
+from numba import njit, types
+
+# Compiled eagerly for the read-only arrays from app.continent_codes() and app.arrays(). This lives in its
+# own module because Streamlit re-executes app.py on every rerun, while an imported module is compiled
+# (or loaded from the on-disk cache) once per process
+@njit(types.int64[:](types.Array(types.int8, 1, 'C', readonly=True),
+                     types.Array(types.float32, 1, 'C', readonly=True),
+                     types.int64, types.int64), cache=True)
+def top_n_by_code(codes, vals, target_code, k):
+    """Row indices of the k largest vals where codes == target_code, via a size-k min-heap"""
+    heap_v = np.full(k, -np.inf, np.float32)
+    heap_i = np.full(k, -1, np.int64)
+    for i in range(codes.size):
+        if codes[i] == target_code and vals[i] > heap_v[0]:
+            heap_v[0] = vals[i]
+            heap_i[0] = i
+            j = 0
+            while True:
+                left = 2 * j + 1
+                right = left + 1
+                smallest = j
+                # Ties rank the later row lower so the earliest rows are kept, matching nlargest
+                if left < k and (heap_v[left] < heap_v[smallest] or
+                                 (heap_v[left] == heap_v[smallest] and heap_i[left] > heap_i[smallest])):
+                    smallest = left
+                if right < k and (heap_v[right] < heap_v[smallest] or
+                                  (heap_v[right] == heap_v[smallest] and heap_i[right] > heap_i[smallest])):
+                    smallest = right
+                if smallest == j:
+                    break
+                heap_v[j], heap_v[smallest] = heap_v[smallest], heap_v[j]
+                heap_i[j], heap_i[smallest] = heap_i[smallest], heap_i[j]
+                j = smallest
+    return heap_i[heap_i >= 0]